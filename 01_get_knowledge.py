@@ -1,73 +1,135 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import os
+import re
+from collections import deque
+from datetime import timedelta
+
+import lxml.etree
+import lxml.html
+import orjson
+from aiohttp_client_cache import CachedSession, SQLiteBackend
 
 API_URL = "https://gdprhub.eu/api.php"
-SESSION = requests.Session()
-SESSION.headers.update({"User-Agent": "gdpr-rag-bot/0.1 (contact: you@example.com)"})
+HEADERS = {"User-Agent": "gdpr-rag-bot/0.1 (contact: you@example.com)"}
+# Concurrent requests against gdprhub.eu, kept low to respect MediaWiki etiquette
+MAX_CONCURRENCY = 10
+# One JSON document per line, written as pages are processed
+OUTPUT_FILE = os.path.join(os.path.dirname(__file__), "data", "gdpr_articles.jsonl")
+# On-disk cache of rendered revisions (gdpr_aiohttp_cache.sqlite) next to the script
+CACHE_NAME = os.path.join(os.path.dirname(__file__), "gdpr_aiohttp_cache")
+CACHE_EXPIRE_AFTER = timedelta(days=7)
+# Attempts per request while the server keeps answering with a maxlag error
+MAXLAG_RETRIES = 5
+
+_ARTICLE_NUM_RE = re.compile(r"article\s+(\d+)", re.IGNORECASE)
+
+
+async def fetch(session, params):
+    """
+    Issue a GET request against the MediaWiki API and return the decoded JSON.
 
+    Adds maxlag=5 so the server can ask us to back off when replication lags.
+    MediaWiki reports errors as HTTP 200 JSON bodies: a maxlag error is retried
+    after Retry-After seconds, any other error code raises RuntimeError.
+    """
+    for _ in range(MAXLAG_RETRIES):
+        async with session.get(API_URL, params={**params, "maxlag": 5}) as r:
+            r.raise_for_status()
+            data = orjson.loads(await r.read())
+            retry_after = int(r.headers.get("Retry-After", 5))
+
+        error = data.get("error")
+        if not error:
+            return data
+        if error.get("code") != "maxlag":
+            raise RuntimeError(f"MediaWiki API error {error.get('code')}: {error.get('info')}")
+        await asyncio.sleep(retry_after)
+
+    raise RuntimeError(f"MediaWiki API still lagged after {MAXLAG_RETRIES} attempts")
 
-def get_candidate_titles(prefix="A", limit_pages=5000):
+
+async def get_candidate_titles(session, prefix="A", limit_pages=5000):
     """
-    Retrieve page titles from gdprhub.eu API, starting from a given prefix.
+    Retrieve page titles and their current revision ids from gdprhub.eu,
+    starting from a given prefix.
     
     Uses the MediaWiki API to paginate through all pages. Can be called
-    multiple times with different prefixes to get all titles.
+    multiple times with different prefixes to get all titles. The listing is
+    used as a generator with prop=info, so each page's lastrevid comes back
+    in the same call; redirects are followed to their target and missing
+    pages are dropped. Returns a dict of {title: revid}.
     """
-    titles = []
-    apcontinue = None
+    revs = {}
+    cont = {}
 
     while True:
         params = {
             "action": "query",
-            "list": "allpages",
-            "apfrom": prefix,
-            "apnamespace": 0,
-            "aplimit": "max",
+            "generator": "allpages",
+            "gapfrom": prefix,
+            "gapnamespace": 0,
+            "gaplimit": "max",
+            "prop": "info",
+            "redirects": 1,
             "format": "json",
+            "formatversion": "2",
+            **cont,
         }
-        if apcontinue:
-            params["apcontinue"] = apcontinue
 
-        r = SESSION.get(API_URL, params=params)
-        r.raise_for_status()
-        data = r.json()
+        data = await fetch(session, params)
 
-        for page in data.get("query", {}).get("allpages", []):
-            titles.append(page["title"])
+        for page in data.get("query", {}).get("pages", []):
+            if not page.get("missing"):
+                revs.setdefault(page["title"], page["lastrevid"])
 
-        apcontinue = data.get("continue", {}).get("apcontinue")
-        if not apcontinue or len(titles) >= limit_pages:
+        cont = data.get("continue")
+        if not cont or len(revs) >= limit_pages:
             break
 
-    return titles
+    return revs
 
 
-def looks_like_gdpr_article(title: str) -> bool:
+def gdpr_article_number(title: str):
     """
-    Check if a page title looks like a GDPR article.
-    
-    Currently checks if both "article" and "gdpr" appear in the title.
+    Return the article number if a page title looks like a GDPR article.
+
+    A title qualifies when it mentions "gdpr" and "article <num>"; it is
+    lowercased once and scanned with a single compiled pattern. Returns None
+    for any other title.
     """
     t = title.lower()
-    return "article" in t and "gdpr" in t
+    if "gdpr" not in t:
+        return None
+    m = _ARTICLE_NUM_RE.search(t)
+    return m.group(1) if m else None
 
 
-def fetch_page_html(title):
+async def fetch_page_html(session, revid):
     params = {
         "action": "parse",
-        "page": title,
+        "oldid": revid,
         "prop": "text",
         "format": "json",
         "formatversion": "2",
     }
-    r = SESSION.get(API_URL, params=params)
-    r.raise_for_status()
-    data = r.json()
+    data = await fetch(session, params)
     return data.get("parse", {}).get("text", "")
 
 
+def element_text(el):
+    """Text of an element and its children, stripped and joined by spaces."""
+    return " ".join(t.strip() for t in el.itertext() if t.strip())
+
+
 def extract_sections_from_html(html):
-    soup = BeautifulSoup(html, "html.parser")
+    if not html:
+        return []
+    try:
+        tree = lxml.html.fromstring(html)
+    except lxml.etree.ParserError:  # whitespace or comment-only pages
+        return []
+    # Inline style/script content would otherwise end up in the section text
+    lxml.etree.strip_elements(tree, "script", "style", with_tail=False)
 
     sections = []
     current_title = "Intro"
@@ -83,28 +145,20 @@ def extract_sections_from_html(html):
         current_title = None
         current_text_parts = []
 
-    for el in soup.find_all(["h2", "h3", "p", "li"]):
-        if el.name in ("h2", "h3"):
+    for el in tree.iter("h2", "h3", "p", "li"):
+        if el.tag in ("h2", "h3"):
             flush_section()
-            current_title = el.get_text(" ", strip=True)
+            current_title = element_text(el)
         else:
-            current_text_parts.append(el.get_text(" ", strip=True))
+            current_text_parts.append(element_text(el))
 
     flush_section()
     return sections
 
 
-def build_article_docs(title, html):
+def build_article_docs(title, html, article_number):
     sections = extract_sections_from_html(html)
 
-    # very rough article number extraction: find "article <num>" in title
-    article_number = None
-    import re
-
-    m = re.search(r"article\s+(\d+)", title, flags=re.I)
-    if m:
-        article_number = m.group(1)
-
     url = "https://gdprhub.eu/index.php?title=" + title.replace(" ", "_")
 
     # join all section texts into one big string
@@ -124,35 +178,66 @@ def build_article_docs(title, html):
 
 
 
-def main():
-    # 1) Broad discovery
-    titles = get_candidate_titles(prefix="A")  # run again with other prefixes if needed
-    print(f"Fetched {len(titles)} titles starting from 'A'")
-
-    # 2) Filter to likely GDPR article commentaries
-    article_titles = [t for t in titles if looks_like_gdpr_article(t)][:]
-    print("Candidate GDPR article pages:")
-    for t in article_titles:
-        print(" -", t)
-
-    all_docs = []
-
-    for title in article_titles:
-        print(f"Processing {title}...")
-        html = fetch_page_html(title)
-        docs = build_article_docs(title, html)
-        all_docs.extend(docs)
-
-    print(f"Built {len(all_docs)} document chunks")
-
-    # Example: show a few chunks
-    with open('gdpr_articles.json', 'w') as w:
-      import json
-      w.write(json.dumps(all_docs, 
-              indent=2, 
-              sort_keys=True)
-      )
+async def main():
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def sem_build(session, title, revid, number):
+        async with sem:
+            print(f"Processing {title}...")
+            try:
+                # Documents are built inside the task, so a finished page waiting
+                # for its turn holds only its small document dicts, not raw HTML
+                return build_article_docs(title, await fetch_page_html(session, revid), number)
+            except Exception as e:
+                # e.g. a revision deleted or hidden since the listing; skip the page
+                print(f"Error processing {title}: {e}")
+                return []
+
+    # One shared session so TCP/TLS connections are reused across requests.
+    # Only the oldid parse calls are cached on disk (a revision never changes),
+    # never MediaWiki errors such as maxlag
+    cache = SQLiteBackend(
+        CACHE_NAME,
+        expire_after=CACHE_EXPIRE_AFTER,
+        filter_fn=lambda r: "MediaWiki-API-Error" not in r.headers,
+    )
+    async with CachedSession(cache=cache, headers=HEADERS) as session:
+        # 1) Broad discovery, with revision ids from the same listing. It must
+        #    always be fresh so edited pages are picked up by their new revid
+        async with session.disabled():
+            revs = await get_candidate_titles(session, prefix="A")  # run again with other prefixes if needed
+        print(f"Fetched {len(revs)} titles starting from 'A'")
+
+        # 2) Filter to likely GDPR article commentaries, extracting the
+        #    article number in the same pass
+        article_revs = []
+        for t, rev in revs.items():
+            number = gdpr_article_number(t)
+            if number:
+                article_revs.append((t, rev, number))
+        print("Candidate GDPR article pages:")
+        for t, _, _ in article_revs:
+            print(" -", t)
+
+        # 3) Render each page once, by revision id, writing its documents as
+        #    they come in instead of holding every document in memory until the end.
+        #    The export goes to a temporary file that only replaces OUTPUT_FILE
+        #    once complete, so an interrupted run never leaves a partial export
+        doc_count = 0
+        tmp_file = OUTPUT_FILE + ".tmp"
+        with open(tmp_file, 'wb') as w:
+            # All fetches start up front; awaiting them in submission order keeps
+            # the output order stable between runs, and each written page is
+            # dropped from the queue
+            tasks = deque(asyncio.create_task(sem_build(session, t, rev, n)) for t, rev, n in article_revs)
+            while tasks:
+                for doc in await tasks.popleft():
+                    w.write(orjson.dumps(doc) + b"\n")
+                    doc_count += 1
+        os.replace(tmp_file, OUTPUT_FILE)
+
+    print(f"Built {doc_count} document chunks")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,45 +1,83 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
 from dotenv import load_dotenv
+from onnx_embeddings import EMBEDDING_VARIANT_KEY, default_variant, embeddings_for_variant
+from transformers import AutoTokenizer
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import os
 import shutil
 import json
+import orjson
+import uuid
 
 load_dotenv()
 
+# Chunks written to Chroma per collection.add call
+ADD_BATCH_SIZE = 2000
+# Documents handed to each splitter worker process
+SPLIT_BATCH_SIZE = 100
+# Cosine distance on unit-norm embeddings, with explicit HNSW build/search parameters
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
+
+@lru_cache(maxsize=None)
+def get_text_splitter():
+    """Splitter measuring chunks in mpnet tokens, built once per process."""
+    tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-mpnet-base-v2")
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
+        chunk_size=384,  # the embedder's max_seq_length
+        chunk_overlap=64,
+    )
+
+def split_batch(documents):
+    return get_text_splitter().split_documents(documents)
+
+def split_documents(documents):
+    """Split documents into chunks, spreading batches over a process pool."""
+    batches = [documents[i:i + SPLIT_BATCH_SIZE] for i in range(0, len(documents), SPLIT_BATCH_SIZE)]
+    if len(batches) <= 1:
+        return split_batch(documents)
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        return [chunk for chunks in pool.map(split_batch, batches) for chunk in chunks]
+
 def load_and_process_json(json_file_path: str):
-    """Load JSON file and convert to LangChain documents."""
+    """Load a JSON array or NDJSON (.jsonl) file and convert to LangChain documents."""
     with open(json_file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+        if json_file_path.endswith('.jsonl'):
+            data = [orjson.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
     
-    documents = []
-    for item in data:
-        # Combine title, id, and text for better context
-        content = f"Title: {item.get('title', '')}\n"
-        content += f"ID: {item.get('id', '')}\n"
-        content += f"Article Number: {item.get('article_number', '')}\n"
-        content += f"Text: {item.get('text', '')}"
-        
-        # Create metadata from JSON fields
-        metadata = {
-            'id': item.get('id', ''),
-            'title': item.get('title', ''),
-            'article_number': item.get('article_number', ''),
-            'type': item.get('type', ''),
-            'url': item.get('url', '')
-        }
-        
-        documents.append(Document(page_content=content, metadata=metadata))
+    # Combine title, id, and text for better context; metadata mirrors the JSON fields
+    documents = [
+        Document(
+            page_content=(
+                f"Title: {item.get('title', '')}\n"
+                f"ID: {item.get('id', '')}\n"
+                f"Article Number: {item.get('article_number', '')}\n"
+                f"Text: {item.get('text', '')}"
+            ),
+            metadata={
+                'id': item.get('id', ''),
+                'title': item.get('title', ''),
+                'article_number': item.get('article_number', ''),
+                'type': item.get('type', ''),
+                'url': item.get('url', '')
+            },
+        )
+        for item in data
+    ]
     
     # Split documents into chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    chunks = text_splitter.split_documents(documents)
+    chunks = split_documents(documents)
     return chunks
 
 def create_vector_store(chunks, persist_directory: str):
@@ -49,24 +87,44 @@ def create_vector_store(chunks, persist_directory: str):
         print(f"Clearing existing vector store at {persist_directory}")
         shutil.rmtree(persist_directory)
     
-    # Initialize HuggingFace embeddings
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-mpnet-base-v2",
-        model_kwargs={'device': 'cpu'}
-    )
+    # Bulk ingestion runs the fp32 model on the GPU whenever one is available and
+    # the int8 ONNX export on CPU otherwise. The variant is recorded on the
+    # collection so the RAG tool embeds its queries with the same model
+    variant = default_variant()
+    embeddings = embeddings_for_variant(variant, use_gpu=True)
     
     # Create and persist Chroma vector store
     print("Creating new vector store...")
-    vectordb = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=persist_directory
+    vectordb = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embeddings,
+        collection_metadata={**COLLECTION_METADATA, EMBEDDING_VARIANT_KEY: variant}
     )
+    add_chunks_in_batches(vectordb, chunks, embeddings)
     return vectordb
 
+def add_chunks_in_batches(vectordb, chunks, embeddings):
+    """Embed all chunks in one pass and insert them in ADD_BATCH_SIZE batches."""
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    ids = [str(uuid.uuid4()) for _ in chunks]
+    vectors = embeddings.embed_documents(texts)
+
+    for i in range(0, len(chunks), ADD_BATCH_SIZE):
+        vectordb._collection.add(
+            ids=ids[i:i + ADD_BATCH_SIZE],
+            embeddings=vectors[i:i + ADD_BATCH_SIZE],
+            metadatas=metadatas[i:i + ADD_BATCH_SIZE],
+            documents=texts[i:i + ADD_BATCH_SIZE],
+        )
+
 def main():
     # Define paths
-    json_file_path = os.path.join(os.path.dirname(__file__), "data", "gdpr_articles.json")
+    data_dir = os.path.join(os.path.dirname(__file__), "data")
+    # Prefer the NDJSON export of 01_get_knowledge.py over the legacy JSON array
+    json_file_path = os.path.join(data_dir, "gdpr_articles.jsonl")
+    if not os.path.exists(json_file_path):
+        json_file_path = os.path.join(data_dir, "gdpr_articles.json")
     db_dir = os.path.join(os.path.dirname(__file__), "chroma_db")
     
     # Process JSON file
@@ -1,7 +1,9 @@
 from smolagents import OpenAIServerModel, ToolCallingAgent, HfApiModel, tool, GradioUI
+from smolagents.models import ChatMessage
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from onnx_embeddings import collection_variant, embeddings_for_variant
+from functools import lru_cache, singledispatch
 import os
 
 
@@ -29,13 +31,67 @@ def get_model(model_id):
 # Create the reasoner model for better RAG (direct text generation, not code)
 reasoning_model = get_model(reasoning_model_id)
 
-# Initialize vector store and embeddings
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-mpnet-base-v2",
-    model_kwargs={'device': 'cpu'}
-)
+@singledispatch
+def extract_response_text(response) -> str:
+    """
+    Extract the generated text from a reasoning model response.
+
+    Dispatches on the response type, so a query costs one cached type lookup
+    rather than a chain of isinstance/hasattr probes. This fallback covers
+    objects with a content attribute and OpenAI-style completions.
+    """
+    if hasattr(response, 'content'):
+        return response.content
+    if getattr(response, 'choices', None):
+        choice = response.choices[0]
+        if hasattr(choice, 'message'):
+            return choice.message.content
+        if hasattr(choice, 'text'):
+            return choice.text
+        if isinstance(choice, dict):
+            return choice.get('message', {}).get('content', str(response))
+        return str(choice)
+    raise TypeError(f"Unknown response type: {type(response)}")
+
+@extract_response_text.register
+def _(response: ChatMessage) -> str:
+    # What HfApiModel and OpenAIServerModel return
+    return response.content
+
+@extract_response_text.register
+def _(response: str) -> str:
+    return response
+
+@extract_response_text.register
+def _(response: dict) -> str:
+    # Dictionary response - try common keys
+    if 'content' in response:
+        return response['content']
+    if 'text' in response:
+        return response['text']
+    if response.get('choices'):
+        return response['choices'][0].get('message', {}).get('content', str(response))
+    return str(response)
+
+@extract_response_text.register
+def _(response: list) -> str:
+    # List response - get first item
+    if not response:
+        raise TypeError("Empty list response")
+    if isinstance(response[0], dict):
+        return response[0].get('content', str(response))
+    return str(response[0])
+
+# Initialize vector store and embeddings. Queries are embedded with the model
+# variant the collection was ingested with, on CPU so the agent needs no VRAM
 db_dir = os.path.join(os.path.dirname(__file__), "chroma_db")
-vectordb = Chroma(persist_directory=db_dir, embedding_function=embeddings)
+vectordb = Chroma(persist_directory=db_dir)
+embeddings = embeddings_for_variant(collection_variant(vectordb))
+
+@lru_cache(maxsize=512)
+def _embed(query: str) -> tuple[float, ...]:
+    """Embed a normalized query once per session, as a hashable tuple."""
+    return tuple(embeddings.embed_query(query))
 
 @tool
 def rag_with_reasoner(user_query: str) -> str:
@@ -47,7 +103,9 @@ def rag_with_reasoner(user_query: str) -> str:
         user_query: The user's question about GDPR-related cases or regulations to query the vector database with.
     """
     # Search for relevant documents - increase k for better coverage
-    docs = vectordb.similarity_search(user_query, k=5)
+    # Collapse whitespace so repeated prompts hit the embedding cache
+    query_vector = _embed(" ".join(user_query.split()))
+    docs = vectordb.similarity_search_by_vector(list(query_vector), k=5)
 
     assert len(docs) > 0, f"No documents found for query: {user_query}"
     
@@ -71,31 +129,22 @@ def rag_with_reasoner(user_query: str) -> str:
     
     assert len(articles_dict) > 0, f"No articles found for query: {user_query}"
 
-    # Build structured context with article metadata
-    context_parts = []
-    article_list = []
-    
-    for article_num, article_info in sorted(articles_dict.items()):
-        # Combine chunks for this article (limit to avoid token bloat)
-        article_content = "\n\n[...continued...]\n\n".join(article_info['chunks'][:2])
-        
-        context_parts.append(f"""
+    # Build structured context with article metadata in one pass. Articles keep
+    # their retrieval order and double as the citation list. Chunks per article
+    # are limited to avoid token bloat
+    chunk_separator = "\n\n[...continued...]\n\n"
+    context = "\n".join([
+        f"""
 --- ARTICLE {article_num}: {article_info['title']} ---
 Article ID: {article_info['id']}
 Source: {article_info['url']}
 
 Relevant Content:
-{article_content}
-""")
-        
-        # Track for citation list
-        article_list.append({
-            'num': article_num,
-            'title': article_info['title'],
-            'url': article_info['url']
-        })
-    
-    context = "\n".join(context_parts)
+{chunk_separator.join(article_info['chunks'][:2])}
+"""
+        for article_num, article_info in articles_dict.items()
+    ])
+    citation_url = next(iter(articles_dict.values()))['url']
     
     # Improved GDPR-specific prompt with citation requirements
     prompt = f"""You are an expert GDPR legal assistant. Analyze the following GDPR articles retrieved from the database 
@@ -118,7 +167,7 @@ Your response MUST follow this structure:
 For each relevant article, include:
 - **Article [number] GDPR - [article title]**
   - Key provisions: [Explain how this article relates to the question]
-  - Citation: {article_list[0]['url'] if article_list else 'Source URL'}
+  - Citation: {citation_url}
 
 [Repeat for each relevant article]
 
@@ -150,40 +199,7 @@ YOUR RESPONSE (with proper citations):"""
         # Try calling the model directly with messages
         response = reasoning_model(messages)
         
-        # Extract text from response (handle different response formats)
-        if isinstance(response, str):
-            response_text = response
-        elif hasattr(response, 'content'):
-            response_text = response.content
-        elif hasattr(response, 'choices') and len(response.choices) > 0:
-            # OpenAI-style response with choices
-            choice = response.choices[0]
-            if hasattr(choice, 'message'):
-                response_text = choice.message.content
-            elif hasattr(choice, 'text'):
-                response_text = choice.text
-            elif isinstance(choice, dict):
-                response_text = choice.get('message', {}).get('content', str(response))
-            else:
-                response_text = str(choice)
-        elif isinstance(response, dict):
-            # Dictionary response - try common keys
-            if 'content' in response:
-                response_text = response['content']
-            elif 'text' in response:
-                response_text = response['text']
-            elif 'choices' in response and len(response['choices']) > 0:
-                response_text = response['choices'][0].get('message', {}).get('content', str(response))
-            else:
-                response_text = str(response)
-        elif isinstance(response, list) and len(response) > 0:
-            # List response - get first item
-            if isinstance(response[0], dict):
-                response_text = response[0].get('content', str(response))
-            else:
-                response_text = str(response[0])
-        else:
-            assert False, f"Unknown response type: {type(response)}"
+        response_text = extract_response_text(response)
     except Exception as e:
         # Fallback: if direct call fails, try alternative methods
         try:
@@ -196,13 +212,11 @@ YOUR RESPONSE (with proper citations):"""
             response_text = f"Error generating response: {str(e)}"
     
     # Append formatted source list
-    if article_list:
-        response_text += "\n\n" + "="*60 + "\n"
-        response_text += "CITED SOURCES:\n"
-        response_text += "="*60 + "\n"
-        for article in article_list:
-            response_text += f"• Article {article['num']} GDPR - {article['title']}\n"
-            response_text += f"  Source: {article['url']}\n\n"
+    separator = "=" * 60
+    response_text += f"\n\n{separator}\nCITED SOURCES:\n{separator}\n" + "".join([
+        f"• Article {article_num} GDPR - {article_info['title']}\n  Source: {article_info['url']}\n\n"
+        for article_num, article_info in articles_dict.items()
+    ])
     
     return response_text
 
@@ -82,7 +82,7 @@ def get_transformed_page_data(title):
                 if "Link" not in k:
                     temp_articles.append(v)
 
-        transformed["gdpr_articles"] = list(set(temp_articles))
+        transformed["gdpr_articles"] = list(dict.fromkeys(temp_articles))
 
     except Exception as e:
         print(f"Error processing {title}: {e}")
@@ -1,26 +1,73 @@
-import requests
-import json
+import asyncio
+import os
+import lxml.etree
+import lxml.html
+import orjson
 import re
 import time
-import html
 import schedule
 from datetime import datetime, timedelta
+from aiohttp_client_cache import CachedSession, SQLiteBackend
 
 API_URL = "https://gdprhub.eu/api.php"
 BASE_URL = "https://gdprhub.eu/index.php?title="
 OUTPUT_FILE = "./data/extracted_weekly.json"
+HEADERS = {"User-Agent": "gdpr-rag-bot/0.1 (contact: you@example.com)"}
+MAX_CONCURRENCY = 5  # Polite concurrency towards gdprhub.eu
+# On-disk HTTP cache next to the script, gdpr_aiohttp_cache.sqlite
+CACHE_NAME = os.path.join(os.path.dirname(__file__), "gdpr_aiohttp_cache")
+CACHE_EXPIRE_AFTER = timedelta(days=7)
+MAXLAG_RETRIES = 5  # Attempts per request while the server keeps answering maxlag
+
+# Template parameters "| Key = Value" and the [[ ]] wiki link brackets around values
+_PARAM_RE = re.compile(r'\|\s*([^=|\n]+?)\s*=\s*([^|{}\n]*)')
+_WIKI_BRACKET_RE = re.compile(r'\[\[|\]\]')
+
+# Wikitext template keys and the case schema fields they fill
+_FIELD_MAP = {
+    "ECLI": ("article_number", "id"),
+    "Type": ("type",),
+    "Jurisdiction": ("jurisdiction",),
+    "Fine": ("fine",),
+    "Currency": ("currency",),
+    "Date Decided": ("date",),
+}
 
 
 def clean_html(raw_html):
     """ Removes HTML tags and cleans up whitespace for the vector index"""
     if not raw_html: return ""
-    clean = re.sub(r'<(script|style).*?>.*?</\1>', '', raw_html, flags=re.DOTALL | re.IGNORECASE)
-    clean = re.sub(r'<[^>]+>', '', clean)
-    return html.unescape(clean).strip()
+    try:
+        tree = lxml.html.fromstring(raw_html)
+    except lxml.etree.ParserError:  # whitespace or comment-only fragments
+        return ""
+    # Entities are decoded by the parser; script/style are dropped in one C-level call
+    lxml.etree.strip_elements(tree, "script", "style", with_tail=False)
+    return " ".join(tree.text_content().split())
+
+
+async def fetch(session, params):
+    """GET against the MediaWiki API with maxlag set, returns the decoded JSON.
+    MediaWiki reports errors in HTTP 200 bodies: maxlag is retried after Retry-After,
+    any other error code raises RuntimeError"""
+    for _ in range(MAXLAG_RETRIES):
+        async with session.get(API_URL, params={**params, "maxlag": 5}) as r:
+            r.raise_for_status()
+            data = orjson.loads(await r.read())
+            retry_after = int(r.headers.get("Retry-After", 5))
 
+        error = data.get("error")
+        if not error:
+            return data
+        if error.get("code") != "maxlag":
+            raise RuntimeError(f"MediaWiki API error {error.get('code')}: {error.get('info')}")
+        await asyncio.sleep(retry_after)
 
-def get_transformed_page_data(title):
-    """Fetches metadata and summary using the MediaWiki API"""
+    raise RuntimeError(f"MediaWiki API still lagged after {MAXLAG_RETRIES} attempts")
+
+
+async def get_transformed_page_data(session, title, revid):
+    """Fetches metadata and summary of one revision using the MediaWiki API"""
 
     # Case schema
     transformed = {
@@ -38,65 +85,50 @@ def get_transformed_page_data(title):
     }
 
     try:
-        # Find English Summary sections as they have different IDs to the article
-        sec_res = requests.get(API_URL, params={
+        # Find English Summary sections as they have different IDs to the article,
+        # the wikitext holding the metadata comes back in the same response
+        page_res = await fetch(session, {
             "action": "parse",
-            "page": title,
-            "prop": "sections",
+            "oldid": revid,
+            "prop": "sections|wikitext",
             "format": "json"
-        }).json()
-        sections = sec_res.get("parse", {}).get("sections", [])
+        })
+        sections = page_res.get("parse", {}).get("sections", [])
 
         summary_idx = next((s.get("index") for s in sections if "English Summary" in s.get("line", "")), None)
 
         if summary_idx:
-            sum_res = requests.get(API_URL, params={
+            sum_res = await fetch(session, {
                 "action": "parse",
-                "page": title,
+                "oldid": revid,
                 "section": summary_idx,
                 "prop": "text",
                 "format": "json"
-            }).json()
+            })
             raw_text = sum_res.get("parse", {}).get("text", {}).get("*", "")
             transformed["text"] = clean_html(raw_text)
 
-        meta_res = requests.get(API_URL, params={
-            "action": "parse",
-            "page": title,
-            "prop": "wikitext",
-            "format": "json"
-        }).json()
-        wikitext = meta_res.get("parse", {}).get("wikitext", {}).get("*", "")
+        wikitext = page_res.get("parse", {}).get("wikitext", {}).get("*", "")
 
         # Extract the fields
-        params = re.findall(r'\|\s*([^=|\n]+?)\s*=\s*([^|{}\n]*)', wikitext)
+        params = _PARAM_RE.findall(wikitext)
 
         temp_articles = []
         for key, val in params:
             k = key.strip()
             # Clean wiki brackets
-            v = re.sub(r'\[\[|\]\]', '', val.strip())
+            v = _WIKI_BRACKET_RE.sub('', val.strip())
 
             if not v: continue
 
-            if k == "ECLI":
-                transformed["article_number"] = v
-                transformed["id"] = v
-            elif k == "Type":
-                transformed["type"] = v
-            elif k == "Jurisdiction":
-                transformed["jurisdiction"] = v
-            elif k == "Fine":
-                transformed["fine"] = v
-            elif k == "Currency":
-                transformed["currency"] = v
-            elif k == "Date Decided":
-                transformed["date"] = v
-            elif k.startswith("GDPR Article"):
-                if "Link" not in k:
-                    temp_articles.append(v)
-
-        transformed["gdpr_articles"] = list(set(temp_articles))
+            targets = _FIELD_MAP.get(k)
+            if targets:
+                for target in targets:
+                    transformed[target] = v
+            elif k.startswith("GDPR Article") and "Link" not in k:
+                temp_articles.append(v)
+
+        transformed["gdpr_articles"] = list(dict.fromkeys(temp_articles))
 
     except Exception as e:
         print(f"Error processing {title}: {e}")
@@ -104,36 +136,55 @@ def get_transformed_page_data(title):
     return transformed
 
 
-def run_weekly_job():
-    print(f"[{datetime.now()}] Starting Extraction...")
-
-    start_time = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%SZ')
-
-    # Get titles of pages created in the last week
+async def fetch_weekly_cases(start_time):
+    """Lists the pages created since start_time and extracts each of them concurrently"""
+    # Get titles of pages created in the last week, with the id of their current
+    # revision (a recentchanges entry carries the creation revision instead)
     list_params = {
         "action": "query",
-        "list": "recentchanges",
-        "rcstart": start_time,
-        "rcdir": "newer",
-        "rctype": "new",
-        "rcnamespace": "0",
-        "rclimit": "500",
-        "format": "json"
+        "generator": "recentchanges",
+        "grcstart": start_time,
+        "grcdir": "newer",
+        "grctype": "new",
+        "grcnamespace": "0",
+        "grclimit": "500",
+        "prop": "info",
+        "format": "json",
+        "formatversion": "2"
     }
 
-    results = []
-    try:
-        response = requests.get(API_URL, params=list_params).json()
-        changes = response.get("query", {}).get("recentchanges", [])
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
 
-        for change in changes:
-            title = change['title']
+    async def sem_task(session, title, revid):
+        async with sem:
             print(f"Processing: {title}")
-            results.append(get_transformed_page_data(title))
-            time.sleep(0.5) # Rate limit avoidance
+            return await get_transformed_page_data(session, title, revid)
+
+    cache = SQLiteBackend(
+        CACHE_NAME,
+        expire_after=CACHE_EXPIRE_AFTER,
+        filter_fn=lambda r: "MediaWiki-API-Error" not in r.headers,  # never cache API errors
+    )
+    async with CachedSession(cache=cache, headers=HEADERS) as session:
+        # The list of new pages must always be fresh; the parse calls are keyed by
+        # revision id, so a cached response can never be an older version of a page
+        async with session.disabled():
+            response = await fetch(session, list_params)
+        pages = [p for p in response.get("query", {}).get("pages", []) if not p.get("missing")]
+
+        return await asyncio.gather(*[sem_task(session, p['title'], p['lastrevid']) for p in pages])
+
+
+def run_weekly_job():
+    print(f"[{datetime.now()}] Starting Extraction...")
+
+    start_time = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    try:
+        results = asyncio.run(fetch_weekly_cases(start_time))
 
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=4, ensure_ascii=False)
+        with open(OUTPUT_FILE, "wb") as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
         print(f"Finished. {len(results)} cases extracted")
 
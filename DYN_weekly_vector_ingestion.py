@@ -1,68 +1,118 @@
 import time
 import os
 import json
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 import schedule
 from dotenv import load_dotenv
+from transformers import AutoTokenizer
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores import Chroma
 from langchain.schema import Document
 
+from onnx_embeddings import (
+    EMBEDDING_VARIANT_KEY,
+    collection_variant,
+    default_variant,
+    embeddings_for_variant,
+)
+
 load_dotenv()
 
+ADD_BATCH_SIZE = 2000  # chunks per collection.add call
+SPLIT_BATCH_SIZE = 100  # documents per splitter worker task
+# Only applied when the collection is created, existing collections keep their settings
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
+
+
+@lru_cache(maxsize=None)
+def get_text_splitter():
+    """Token-based splitter sized to the mpnet context window, one per process"""
+    tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-mpnet-base-v2")
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer, chunk_size=384, chunk_overlap=64
+    )
+
+
+def split_batch(documents):
+    return get_text_splitter().split_documents(documents)
+
+
+def split_documents(documents):
+    """Split documents into chunks, in parallel worker processes when there are several batches"""
+    batches = [documents[i:i + SPLIT_BATCH_SIZE] for i in range(0, len(documents), SPLIT_BATCH_SIZE)]
+    if len(batches) <= 1:
+        return split_batch(documents)
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        return [chunk for chunks in pool.map(split_batch, batches) for chunk in chunks]
+
 
 def load_and_process_json(json_file_path: str):
     """Load JSON file and convert to LangChain documents"""
     with open(json_file_path, "r", encoding="utf-8") as f:
         data = json.load(f)
 
-    documents = []
-    for item in data:
-
-        content = (
-            f"Title: {item.get('title', '')}\n"
-            f"ID: {item.get('id', '')}\n"
-            f"Article Number: {item.get('article_number', '')}\n"
-            f"Text: {item.get('text', '')}"
+    documents = [
+        Document(
+            page_content=(
+                f"Title: {item.get('title', '')}\n"
+                f"ID: {item.get('id', '')}\n"
+                f"Article Number: {item.get('article_number', '')}\n"
+                f"Text: {item.get('text', '')}"
+            ),
+            metadata={
+                "id": item.get("id", ""),
+                "title": item.get("title", ""),
+                "article_number": item.get("article_number", ""),
+                "type": item.get("type", ""),
+                "jurisdiction": item.get("jurisdiction", ""),
+                "url": item.get("url", ""),
+                "date": item.get("data", ""),
+                "fine": item.get("fine", ""),
+                "currency": item.get("currency", ""),
+                "gdpr_articles": item.get("gdpr_articles", ""),
+            },
         )
+        for item in data
+    ]
 
-        metadata = {
-            "id": item.get("id", ""),
-            "title": item.get("title", ""),
-            "article_number": item.get("article_number", ""),
-            "type": item.get("type", ""),
-            "jurisdiction": item.get("jurisdiction", ""),
-            "url": item.get("url", ""),
-            "date": item.get("data", ""),
-            "fine": item.get("fine", ""),
-            "currency": item.get("currency", ""),
-            "gdpr_articles": item.get("gdpr_articles", ""),
-        }
-
-        documents.append(Document(page_content=content, metadata=metadata))
-
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    chunks = text_splitter.split_documents(documents)
+    chunks = split_documents(documents)
     return chunks
 
 
+def add_chunks_in_batches(vectordb, chunks, embeddings):
+    """Embed the chunks once and write them to the collection in fixed-size batches"""
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    ids = [str(uuid.uuid4()) for _ in chunks]
+    vectors = embeddings.embed_documents(texts)
+
+    for i in range(0, len(chunks), ADD_BATCH_SIZE):
+        vectordb._collection.add(
+            ids=ids[i:i + ADD_BATCH_SIZE],
+            embeddings=vectors[i:i + ADD_BATCH_SIZE],
+            metadatas=metadatas[i:i + ADD_BATCH_SIZE],
+            documents=texts[i:i + ADD_BATCH_SIZE],
+        )
+
+
 def create_or_update_vector_store(chunks, persist_directory: str):
     """Create or update a persisted Chroma vector store"""
-    # Initialize embeddings
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-mpnet-base-v2",
-        model_kwargs={"device": "cpu"},
-    )
-
     if os.path.exists(persist_directory):
         print(f"Loading existing vector store at {persist_directory}")
-        vectordb = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+        vectordb = Chroma(persist_directory=persist_directory)
+        # New chunks are embedded with the variant already stored in the collection,
+        # whatever hardware this run has
+        embeddings = embeddings_for_variant(collection_variant(vectordb), use_gpu=True)
 
         try:
             ids_to_remove = [doc.metadata.get("id") for doc in chunks if doc.metadata.get("id")]
@@ -74,14 +124,18 @@ def create_or_update_vector_store(chunks, persist_directory: str):
             pass
 
         # Add new/updated chunks
-        vectordb.add_documents(chunks)
+        add_chunks_in_batches(vectordb, chunks, embeddings)
     else:
         print("Creating new vector store...")
-        vectordb = Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings,
+        # fp32 on the GPU when there is one, otherwise the int8 ONNX export on CPU
+        variant = default_variant()
+        embeddings = embeddings_for_variant(variant, use_gpu=True)
+        vectordb = Chroma(
             persist_directory=persist_directory,
+            embedding_function=embeddings,
+            collection_metadata={**COLLECTION_METADATA, EMBEDDING_VARIANT_KEY: variant},
         )
+        add_chunks_in_batches(vectordb, chunks, embeddings)
 
     # Ensure persistence
     try:
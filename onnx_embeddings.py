@@ -0,0 +1,92 @@
+import numpy as np
+import onnxruntime as ort
+import torch
+from huggingface_hub import hf_hub_download
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+from tokenizers import Tokenizer
+
+MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+# Dynamically quantized int8 export published alongside the model, built for VNNI kernels
+ONNX_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+# sentence-transformers' max_seq_length for all-mpnet-base-v2
+MAX_SEQ_LENGTH = 384
+# Collection metadata key naming the model variant that embedded the stored vectors
+EMBEDDING_VARIANT_KEY = "embedding_variant"
+TORCH_FP32 = "torch-fp32"
+ONNX_INT8 = "onnx-int8"
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    all-mpnet-base-v2 embeddings computed with onnxruntime on the CPU.
+
+    Runs the int8 ONNX export directly and reproduces the sentence-transformers
+    pipeline around it: mpnet tokenization, attention-masked mean pooling and
+    L2 normalisation, so vectors are unit-norm like normalize_embeddings=True.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, file_name=ONNX_FILE, batch_size=64):
+        self.batch_size = batch_size
+
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(model_name, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("<pad>"), pad_token="<pad>")
+
+        self.session = ort.InferenceSession(
+            hf_hub_download(model_name, file_name),
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.zeros_like(input_ids)
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        # Mean over real tokens only, then scale each vector to unit length
+        mask = attention_mask[..., None].astype(token_embeddings.dtype)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts):
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self._encode(texts[i:i + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self._encode([text])[0].tolist()
+
+
+def default_variant():
+    """The variant a new collection is built with: fp32 torch on a GPU, int8 ONNX on CPU."""
+    return TORCH_FP32 if torch.cuda.is_available() else ONNX_INT8
+
+
+def collection_variant(vectordb):
+    """
+    The variant recorded on a Chroma store's collection.
+
+    Collections created before the key existed were embedded by the fp32
+    torch model, so that is the default.
+    """
+    return (vectordb._collection.metadata or {}).get(EMBEDDING_VARIANT_KEY, TORCH_FP32)
+
+
+def embeddings_for_variant(variant, use_gpu=False):
+    """Embedder producing vectors of the given variant, unit-norm in both cases."""
+    if variant == ONNX_INT8:
+        return OnnxEmbeddings(batch_size=64)
+
+    device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
+    return HuggingFaceEmbeddings(
+        model_name=MODEL_NAME,
+        model_kwargs={"device": device},
+        encode_kwargs={"batch_size": 128 if device == "cuda" else 64, "normalize_embeddings": True},
+    )
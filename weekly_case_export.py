@@ -1,37 +1,73 @@
-import requests
-import json
+import os
+import requests_cache
+import lxml.etree
+import lxml.html
+import orjson
 import re
 import time
 import schedule
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 API_URL = "https://gdprhub.eu/api.php"
 OUTPUT_FILE = "extracted_weekly.json"
 
+# Template parameters "| Key = Value" and the [[ ]] wiki link brackets around values
+_PARAM_RE = re.compile(r'\|\s*([^=|\n]+?)\s*=\s*([^|{}\n]*)')
+_WIKI_BRACKET_RE = re.compile(r'\[\[|\]\]')
+
 def clean_html(raw_html):
     # Removes HTML tags and cleans up whitespace for the vector index
     if not raw_html: return ""
-    clean = re.sub(r'<(script|style).*?>.*?</\1>', '', raw_html, flags=re.DOTALL | re.IGNORECASE)
-    clean = re.sub(r'<[^>]+>', '', clean)
-    import html
-    return html.unescape(clean).strip()
-
-
-def get_page_data(title):
-    # Fetches metadata and summary using the MediaWiki Parse API
+    try:
+        tree = lxml.html.fromstring(raw_html)
+    except lxml.etree.ParserError:  # whitespace or comment-only fragments
+        return ""
+    # Entities are decoded by the parser; script/style are dropped in one C-level call
+    lxml.etree.strip_elements(tree, "script", "style", with_tail=False)
+    return " ".join(tree.text_content().split())
+
+
+def make_session():
+    # Session shared by a whole job so every case reuses pooled TLS connections, with
+    # backoff on 429/5xx. Responses are cached on disk for 7 days, MediaWiki API errors
+    # are never stored. Built per job, so importing this module touches no files
+    session = requests_cache.CachedSession(
+        # Kept apart from the aiohttp scripts' cache, the two libraries use different schemas
+        os.path.join(os.path.dirname(__file__), "gdpr_requests_cache"),
+        backend="sqlite",
+        expire_after=timedelta(days=7),
+        filter_fn=lambda r: "MediaWiki-API-Error" not in r.headers,
+    )
+    session.mount("https://", HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+    ))
+    session.headers.update({
+        "User-Agent": "gdpr-rag-bot/0.1 (contact: you@example.com)",
+        "Accept-Encoding": "gzip",
+    })
+    return session
+
+
+def get_page_data(session, title, revid):
+    # Fetches metadata and summary of one revision using the MediaWiki Parse API
     data = {"Page Title": title}
 
-    # Find English Summary section index, these have a different id from the case
-    sections_params = {
+    # Find English Summary section index, these have a different id from the case.
+    # The wikitext with the metadata is requested in the same call
+    page_params = {
         "action": "parse",
-        "page": title,
-        "prop": "sections",
+        "oldid": revid,
+        "prop": "sections|wikitext",
         "format": "json"
     }
 
     try:
-        sec_res = requests.get(API_URL, params=sections_params).json()
-        sections = sec_res.get("parse", {}).get("sections", [])
+        page_res = orjson.loads(session.get(API_URL, params=page_params).content)
+        sections = page_res.get("parse", {}).get("sections", [])
 
         summary_index = None
         for s in sections:
@@ -42,31 +78,24 @@ def get_page_data(title):
         if summary_index:
             summary_params = {
                 "action": "parse",
-                "page": title,
+                "oldid": revid,
                 "section": summary_index,
                 "prop": "text",
                 "format": "json"
             }
-            sum_res = requests.get(API_URL, params=summary_params).json()
+            sum_res = orjson.loads(session.get(API_URL, params=summary_params).content)
             raw_summary = sum_res.get("parse", {}).get("text", {}).get("*", "")
             data["Summary"] = clean_html(raw_summary)
         else:
             data["Summary"] = "No Summary found"
 
-        meta_params = {
-            "action": "parse",
-            "page": title,
-            "prop": "wikitext",
-            "format": "json"
-        }
-        meta_res = requests.get(API_URL, params=meta_params).json()
-        wikitext = meta_res.get("parse", {}).get("wikitext", {}).get("*", "")
+        wikitext = page_res.get("parse", {}).get("wikitext", {}).get("*", "")
 
         # Extract fields
-        params = re.findall(r'\|\s*([^=|\n]+?)\s*=\s*([^|{}\n]*)', wikitext)
+        params = _PARAM_RE.findall(wikitext)
         for key, val in params:
             k = key.strip().replace("_", " ")
-            v = re.sub(r'\[\[|\]\]', '', val.strip())
+            v = _WIKI_BRACKET_RE.sub('', val.strip())
             if k and v:
                 data[k] = v
 
@@ -80,35 +109,42 @@ def run_weekly_job():
     print(f"[{datetime.now()}] Starting Extraction...")
     start_time = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%SZ')
 
-    # Get titles of pages created in the last week
+    # Get titles of pages created in the last week, with the id of their current
+    # revision (a recentchanges entry carries the creation revision instead)
     list_params = {
         "action": "query",
-        "list": "recentchanges",
-        "rcstart": start_time,
-        "rcdir": "newer",
-        "rctype": "new",
-        "rcnamespace": "0",
-        "rclimit": "500",
-        "format": "json"
+        "generator": "recentchanges",
+        "grcstart": start_time,
+        "grcdir": "newer",
+        "grctype": "new",
+        "grcnamespace": "0",
+        "grclimit": "500",
+        "prop": "info",
+        "format": "json",
+        "formatversion": "2"
     }
 
     results = []
-    try:
-        list_res = requests.get(API_URL, params=list_params).json()
-        changes = list_res.get("query", {}).get("recentchanges", [])
-
-        for change in changes:
-            title = change['title']
-            print(f"Processing: {title}")
-            results.append(get_page_data(title))
-            time.sleep(0.5)  # Rate limit avoidance
-
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=4, ensure_ascii=False)
-        print(f"Finished. {len(results)} cases extracted")
-
-    except Exception as e:
-        print(f"Job Failed: {e}")
+    with make_session() as session:
+        try:
+            # The list of new pages must always be fresh; the parse calls are keyed by
+            # revision id, so a cached response can never be an older version of a page
+            with session.cache_disabled():
+                list_res = orjson.loads(session.get(API_URL, params=list_params).content)
+            pages = [p for p in list_res.get("query", {}).get("pages", []) if not p.get("missing")]
+
+            for page in pages:
+                title = page['title']
+                print(f"Processing: {title}")
+                results.append(get_page_data(session, title, page['lastrevid']))
+                time.sleep(0.5)  # Rate limit avoidance
+
+            with open(OUTPUT_FILE, "wb") as f:
+                f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+            print(f"Finished. {len(results)} cases extracted")
+
+        except Exception as e:
+            print(f"Job Failed: {e}")
 
 
 schedule.every().monday.at("00:01").do(run_weekly_job)